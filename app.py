@@ -1,4 +1,11 @@
 import os
+import time
+import uuid
+import threading
+import orjson
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
 
 from topographic import TopographicPlan
@@ -6,12 +13,99 @@ from topographic import TopographicPlan
 load_dotenv()  # reads .env into environment
 
 from cadastral import CadastralPlan
+from worker import FORMATS, run_plan
+
+from flask import Flask, request, jsonify, url_for
+from flask.json.provider import JSONProvider
+
+
+class ORJSONProvider(JSONProvider):
+    # orjson for request parsing and jsonify responses
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
-from flask import Flask, request, jsonify
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.config["SECRET_KEY"] = "secret"
 
+def new_executor() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=int(os.environ.get("PLAN_WORKERS", os.cpu_count() or 1)),
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+# plans are CPU bound, so they are drawn in worker processes (spawned, as the
+# server threads make fork unsafe); ?async=true jobs are polled through /jobs/<job_id>
+executor = new_executor()
+executor_lock = threading.Lock()
+
+# async jobs as job_id -> [message, future, finished_at]; finished jobs are kept for JOB_TTL
+# seconds to be polled, and at most MAX_PENDING_JOBS may be queued or running at once
+JOB_TTL = int(os.environ.get("PLAN_JOB_TTL", 3600))
+MAX_PENDING_JOBS = int(os.environ.get("PLAN_MAX_PENDING_JOBS", 32))
+jobs = {}
+jobs_lock = threading.Lock()
+
+
+def submit_run(plan_class, payload: bytes, formats: tuple):
+    # a worker dying (out of memory, a crash in native code) breaks the whole pool,
+    # so a broken pool is replaced once and the plan submitted to the new one
+    global executor
+    pool = executor
+    try:
+        return pool.submit(run_plan, plan_class, payload, formats)
+    except BrokenProcessPool:
+        with executor_lock:
+            if executor is pool:
+                app.logger.warning("Plan process pool is broken, starting a new one")
+                executor = new_executor()
+                pool.shutdown(wait=False)
+            return executor.submit(run_plan, plan_class, payload, formats)
+
+
+def evict_jobs() -> int:
+    # called holding jobs_lock: drops finished jobs nobody polled within JOB_TTL, returning how many are pending
+    now = time.monotonic()
+    expired = [job_id for job_id, (_, _, finished_at) in jobs.items()
+               if finished_at is not None and now - finished_at > JOB_TTL]
+    for job_id in expired:
+        del jobs[job_id]
+    return sum(1 for _, future, _ in jobs.values() if not future.done())
+
+
+def submit_plan(plan_class, payload: bytes, message: str):
+    requested = {f.strip() for f in request.args.get("formats", ",".join(FORMATS)).lower().split(",")} - {""}
+    if not requested or not requested <= set(FORMATS):
+        return jsonify({"error": f"formats must be a comma separated list of {', '.join(FORMATS)}"}), 400
+    formats = tuple(f for f in FORMATS if f in requested)
+
+    if request.args.get("async", "").lower() not in ("1", "true"):
+        try:
+            result = submit_run(plan_class, payload, formats).result()
+        except BrokenProcessPool:
+            # the pool broke under this plan, submitting it again replaces the pool
+            result = submit_run(plan_class, payload, formats).result()
+        return jsonify({"message": message, **result}), 200
+
+    job_id = uuid.uuid4().hex
+    job = [message, None, None]
+    with jobs_lock:
+        if evict_jobs() >= MAX_PENDING_JOBS:
+            return jsonify({"error": "Too many plans in progress, try again later"}), 503
+        job[1] = future = submit_run(plan_class, payload, formats)
+        jobs[job_id] = job
+
+    def stamp_finished(_):
+        # runs in the executor's thread once the plan finishes, starting the job's TTL
+        job[2] = time.monotonic()
+
+    future.add_done_callback(stamp_finished)
+    return jsonify({"message": "Plan generation started", "job_id": job_id,
+                    "status_url": url_for("get_job", job_id=job_id)}), 202
+
 
 @app.get("/")
 def home():
@@ -19,23 +113,34 @@ def home():
 
 @app.route("/cadastral/plan", methods=["POST"])
 def generate_cadastral_plan():
-    data = request.get_json()
-
-    plan = CadastralPlan(**data)
-    plan.draw()
-
-    url = plan.save()
-    return jsonify({"message": "Cadastral plan generated", "filename": plan.name, "url": url}), 200
+    return submit_plan(CadastralPlan, request.get_data(), "Cadastral plan generated")
 
 @app.route("/topographic/plan", methods=["POST"])
 def generate_topographic_plan():
-    data = request.get_json()
-
-    plan = TopographicPlan(**data)
-    plan.draw()
-
-    url = plan.save()
-    return jsonify({"message": "Topographic plan generated", "filename": plan.name, "url": url}), 200
+    return submit_plan(TopographicPlan, request.get_data(), "Topographic plan generated")
+
+@app.get("/jobs/<job_id>")
+def get_job(job_id):
+    with jobs_lock:
+        evict_jobs()
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+
+        message, future, _ = job
+        if not future.done():
+            return jsonify({"job_id": job_id, "status": "pending"}), 202
+
+        # results are handed out once
+        del jobs[job_id]
+
+    try:
+        result = future.result()
+    except Exception as e:
+        app.logger.error(f"Plan job {job_id} failed: {e}", exc_info=e)
+        return jsonify({"job_id": job_id, "status": "failed", "error": "An unexpected error occurred"}), 500
+
+    return jsonify({"message": message, "job_id": job_id, "status": "done", **result}), 200
 
 
 @app.errorhandler(404)
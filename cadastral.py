@@ -1,9 +1,11 @@
 from dxf import SurveyDXFManager
 from models.plan import PlanProps, PlanType
-from utils import polygon_orientation, line_normals, line_direction, html_to_mtext
+from utils import polygon_stats, leg_label_records, html_to_mtext
 from pydantic import PrivateAttr
 
 import math
+import itertools
+import numpy as np
 
 class CadastralPlan(PlanProps):
     _drawer: SurveyDXFManager = PrivateAttr()
@@ -16,8 +18,9 @@ class CadastralPlan(PlanProps):
         self._frame_x_percent = 0.35
         self._frame_y_percent = 0.8
         self._bounding_box = self.get_bounding_box()
+        self._drawing_extent = self._get_drawing_extent()
         self._frame_coords = self._setup_frame_coords()
-        self._coord_dict = {coord.id: coord for coord in self.coordinates}
+        self._border_coords = self._setup_frame_coords(padding=0.03)
         if not self._frame_coords:
             raise ValueError("Cannot determine frame coordinates without valid coordinates.")
         self._drawer = self._setup_drawer()
@@ -28,7 +31,7 @@ class CadastralPlan(PlanProps):
         drawer.setup_beacon_style(self.beacon_type, self.beacon_size)
         return drawer
 
-    def _setup_frame_coords(self):
+    def _setup_frame_coords(self, padding: float = 0.0):
         min_x, min_y, max_x, max_y = self._bounding_box
         if min_x is None or min_y is None or max_x is None or max_y is None:
             return None
@@ -36,8 +39,10 @@ class CadastralPlan(PlanProps):
         width = max_x - min_x
         height = max_y - min_y
 
-        margin_x = max(width, height) * self._frame_x_percent
-        margin_y = max(height, width) * self._frame_y_percent
+        # margins are proportional to the larger side of the bounding box
+        size = max(width, height)
+        margin_x = size * (self._frame_x_percent + padding)
+        margin_y = size * (self._frame_y_percent + padding)
 
         frame_left = min_x - margin_x
         frame_bottom = min_y - margin_y
@@ -61,95 +66,62 @@ class CadastralPlan(PlanProps):
         if not self.coordinates:
             return
 
-        for coord in self.coordinates:
-            self._drawer.draw_beacon(coord.easting, coord.northing, 0, self.label_size, self._get_drawing_extent(), coord.id)
+        eastings, northings, _ = self._coordinate_arrays
+        ids = [coord.id for coord in self.coordinates]
+        self._drawer.draw_beacons(eastings, northings, ids, self.label_size, self._drawing_extent)
 
     def draw_parcels(self):
         if not self.parcels or not self.coordinates:
             return
 
-        for parcel in self.parcels:
-            parcel_points = [(self._coord_dict[pid].easting, self._coord_dict[pid].northing)
-                             for pid in parcel.ids if pid in self._coord_dict]
-
-            if not parcel_points:
-                continue
-
-            self._drawer.add_parcel(parcel.name, parcel_points, label_size=self.label_size)
-            orientation = polygon_orientation(parcel_points)
-
-            for leg in parcel.legs:
-               self.add_leg_labels(leg, orientation)
-
-    def add_leg_labels(self, leg, orientation: str):
-        """Add distance and bearing labels to a leg."""
-        # Angle and positions
-        angle_rad = math.atan2(leg.to.northing - leg.from_.northing,
-                               leg.to.easting - leg.from_.easting)
-        angle_deg = math.degrees(angle_rad)
-
-        # Fractional positions
-        first_x =  leg.from_.easting + (0.2 * (leg.to.easting - leg.from_.easting))
-        first_y = leg.from_.northing + (0.2 * (leg.to.northing - leg.from_.northing))
-        last_x = leg.from_.easting + (0.8 * (leg.to.easting - leg.from_.easting))
-        last_y = leg.from_.northing + (0.8 * (leg.to.northing - leg.from_.northing))
-        mid_x = (leg.from_.easting + leg.to.easting) / 2
-        mid_y = (leg.from_.northing + leg.to.northing) / 2
-
-        # Offset text above/below the line
-        normals = line_normals((leg.from_.easting, leg.from_.northing), (leg.to.easting, leg.to.northing), orientation)
-        offset_distance = self._get_drawing_extent() * 0.02
-        offset_inside_x = (normals[0][0] / math.hypot(*normals[0])) * offset_distance
-        offset_inside_y = (normals[0][1] / math.hypot(*normals[0])) * offset_distance
-        offset_outside_x = (normals[1][0] / math.hypot(*normals[1])) * offset_distance
-        offset_outside_y = (normals[1][1] / math.hypot(*normals[1])) * offset_distance
-
-        first_x += offset_outside_x; first_y += offset_outside_y
-        last_x += offset_outside_x; last_y += offset_outside_y
-        mid_x += offset_inside_x; mid_y += offset_inside_y
-
-        # Text angle adjustment
-        text_angle = angle_deg
-        if text_angle > 90 or text_angle < -90:
-            text_angle += 180
-
-        # Add labels
-        self._drawer.add_text(f"{leg.distance:.2f} m", mid_x, mid_y,
-                        angle=text_angle, height=self.label_size)
-        ld = line_direction(angle_deg)
-        if ld == "left → right":
-            self._drawer.add_text(f"{leg.bearing.degrees}°", first_x, first_y,
-                            angle=text_angle, height=self.label_size)
-            self._drawer.add_text(f"{leg.bearing.minutes}'", last_x, last_y,
-                            angle=text_angle, height=self.label_size)
-        else:
-            self._drawer.add_text(f"{leg.bearing.degrees}°", last_x, last_y,
-                            angle=text_angle, height=self.label_size)
-            self._drawer.add_text(f"{leg.bearing.minutes}'", first_x, first_y,
-                            angle=text_angle, height=self.label_size)
+        # polygons of every parcel, then one batched label layout over all of their legs
+        polygons = [self._parcel_polygon(parcel) for parcel in self.parcels]
+        labels = self.build_leg_labels([parcel.legs for parcel in self.parcels],
+                                       [orientation for _, orientation, _ in polygons],
+                                       self._drawing_extent * 0.02)
+
+        # all parcel outlines, then all of their labels, so entities of a layer are emitted together
+        for parcel, (parcel_points, _, centroid) in zip(self.parcels, polygons):
+            if parcel_points is not None:
+                self._drawer.add_parcel(parcel.name, parcel_points, label_size=self.label_size, centroid=centroid)
+
+        self._drawer.add_texts([record for (parcel_points, _, _), records in zip(polygons, labels)
+                                if parcel_points is not None for record in records])
+
+    def _parcel_polygon(self, parcel):
+        """Polygon points, orientation and centroid of a parcel, without touching the drawing."""
+        index = self._coordinate_index
+        idx = np.fromiter((index[pid] for pid in parcel.ids if pid in index), dtype=np.intp)
+        if not idx.size:
+            return None, 0, None
+
+        eastings, northings, _ = self._coordinate_arrays
+        parcel_points = np.column_stack((eastings[idx], northings[idx]))
+        _, cx, cy, orientation = polygon_stats(parcel_points)
+        return parcel_points, orientation, (cx, cy)
+
+    def build_leg_labels(self, parcel_legs: list, orientations: list, offset_distance: float) -> list:
+        """Distance and bearing label records (text, x, y, angle, height), one list per parcel."""
+        legs = [leg for legs in parcel_legs for leg in legs]
+        counts = [len(legs) for legs in parcel_legs]
+
+        # every parcel's legs labelled in one batched pass, each leg carrying its parcel's orientation
+        orientation = np.repeat(np.asarray(orientations, dtype=np.float64), counts)
+        records = leg_label_records(legs, orientation, offset_distance, self.label_size)
+
+        # three records per leg, split back per parcel
+        ends = itertools.accumulate(3 * n for n in counts)
+        return [records[end - 3 * n:end] for n, end in zip(counts, ends)]
 
     def draw_frames(self):
         """Draw outer and offset frames."""
-        min_x, min_y, max_x, max_y = self._bounding_box
-        width, height = max_x - min_x, max_y - min_y
-
-        margin_x, margin_y = max(width, height) * self._frame_x_percent, max(height, width) * self._frame_y_percent
-        frame_left, frame_bottom = min_x - margin_x, min_y - margin_y
-        frame_right, frame_top = max_x + margin_x, max_y + margin_y
-        self._drawer.draw_frame(frame_left, frame_bottom, frame_right, frame_top)
-
-        offset_x, offset_y = max(width, height) * (self._frame_x_percent + 0.03), max(height, width) * (self._frame_y_percent + 0.03)
-        self._drawer.draw_frame(min_x - offset_x, min_y - offset_y,
-                          max_x + offset_x, max_y + offset_y)
+        self._drawer.draw_frame(*self._frame_coords)
+        self._drawer.draw_frame(*self._border_coords)
 
     def draw_title_block(self):
         """Add title block to the frame."""
-        min_x, min_y, max_x, max_y = self._bounding_box
-        width, height = max_x - min_x, max_y - min_y
-
-        margin_x, margin_y = max(width, height) * self._frame_x_percent, max(height, width) * self._frame_y_percent
-        frame_left, frame_bottom = min_x - margin_x, min_y - margin_y
-        frame_right, frame_top = max_x + margin_x, max_y + margin_y
+        frame_left, frame_bottom, frame_right, frame_top = self._frame_coords
+        margin_y = frame_top - self._bounding_box[3]
 
         frame_width = frame_right - frame_left
         frame_center_x = frame_left + (frame_width / 2)
@@ -160,7 +132,7 @@ class CadastralPlan(PlanProps):
                          title_y,
                          frame_width * 0.6,
                          self.font_size,
-                                      graphical_scale_length=(self._frame_coords[2] - self._frame_coords[0]) * 0.4,
+                                      graphical_scale_length=frame_width * 0.4,
                                       area=f"AREA :- {self.parcels[0].area} SQ.METRES",
                                       origin=f"ORIGIN :- {self.origin.upper()}")
 
@@ -168,10 +140,7 @@ class CadastralPlan(PlanProps):
         if len(self.footers) == 0:
             return
 
-        x_min = self._frame_coords[0]
-        y_min = self._frame_coords[1]
-        x_max = self._frame_coords[2]
-        y_max = self._frame_coords[3]
+        x_min, y_min, x_max, y_max = self._frame_coords
 
         box_width = (x_max - x_min) / len(self.footers)
         box_height = (y_max - y_min) * 0.25
@@ -187,29 +156,32 @@ class CadastralPlan(PlanProps):
         if len(self.parcels) == 0:
             return
 
-        coord = self._coord_dict[self.parcels[0].ids[0]]
-        height = (self._frame_coords[3] - self._frame_coords[1]) * 0.07
-        self._drawer.draw_north_arrow(coord.easting, self._frame_coords[3] - height, height)
+        eastings, northings, _ = self._coordinate_arrays
+        i = self._coordinate_index[self.parcels[0].ids[0]]
+        easting, northing = float(eastings[i]), float(northings[i])
+        frame_left, frame_bottom, frame_right, frame_top = self._frame_coords
+        height = (frame_top - frame_bottom) * 0.07
+        self._drawer.draw_north_arrow(easting, frame_top - height, height)
 
         # for easting label
-        width = (self._frame_coords[2] - self._frame_coords[0]) * 0.1
+        width = (frame_right - frame_left) * 0.1
 
-        self._drawer.add_north_arrow_label((self._frame_coords[0], coord.northing),
-                                           (self._frame_coords[0] + width, coord.northing), f"{coord.easting}mE",
+        self._drawer.add_north_arrow_label((frame_left, northing),
+                                           (frame_left + width, northing), f"{easting}mE",
                                            self.label_size)
-        self._drawer.add_north_arrow_label((self._frame_coords[2], coord.northing),
-                                           (self._frame_coords[2] - width, coord.northing), "",
+        self._drawer.add_north_arrow_label((frame_right, northing),
+                                           (frame_right - width, northing), "",
                                            self.label_size)
 
         # for northing label
-        northing_label_y = self._frame_coords[1]
+        northing_label_y = frame_bottom
         if len(self.footers) > 0:
-            northing_label_y = northing_label_y + ((self._frame_coords[3] - self._frame_coords[1]) * 0.25)
+            northing_label_y = northing_label_y + ((frame_top - frame_bottom) * 0.25)
 
-        self._drawer.add_north_arrow_label((coord.easting, northing_label_y),
-                                           (coord.easting, northing_label_y + height), f"{coord.northing}mN",
+        self._drawer.add_north_arrow_label((easting, northing_label_y),
+                                           (easting, northing_label_y + height), f"{northing}mN",
                                            self.label_size)
-        self._drawer.draw_north_arrow_cross(coord.easting, coord.northing, self.beacon_size * 3)
+        self._drawer.draw_north_arrow_cross(easting, northing, self.beacon_size * 3)
 
     def draw(self):
         # Draw elements
@@ -223,8 +195,8 @@ class CadastralPlan(PlanProps):
     def save_dxf(self, file_path: str):
         self._drawer.save_dxf(file_path)
 
-    def save(self) -> str:
-        return self._drawer.save(paper_size=self.page_size, orientation=self.page_orientation)
+    def save(self, formats: tuple = ("dxf", "dwg", "pdf")) -> str:
+        return self._drawer.save(paper_size=self.page_size, orientation=self.page_orientation, formats=formats)
 
 
 
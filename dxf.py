@@ -5,26 +5,64 @@ from ezdxf.addons.drawing import Frontend, RenderContext, pymupdf, layout, confi
 from ezdxf.tools.text import MTextEditor
 from ezdxf.addons import odafc
 import tempfile
+import io
 import os
 from datetime import datetime
+from functools import lru_cache
 import uuid
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from upload import upload_file
 from ezdxf import bbox, colors
+from ezdxf.math import Vec3
+from ezdxf.render import MeshBuilder
 import subprocess
 import math
+import numpy as np
 from typing import List, Tuple, Dict, Optional, Union
 
 
+# plan name -> file name cleanup
+_UNSAFE_CHARS_RE = re.compile(r"[^a-z0-9._\s-]")
+_SEPARATORS_RE = re.compile(r"[\s_]+")
+
+
+@lru_cache(maxsize=64)
+def _file_stem(plan_name: str) -> str:
+    # drop unsafe characters, then fold whitespace and underscore runs into one "_"
+    return _SEPARATORS_RE.sub("_", _UNSAFE_CHARS_RE.sub("", plan_name.lower()))
+
+
+# Paper sizes in mm
+PAPER_SIZES = {
+    "A4": (210, 297),
+    "A3": (297, 420),
+    "A5": (148, 210),
+    "Letter": (216, 279),
+    "Legal": (216, 356),
+}
+
+# PDF rendering configuration, immutable and shared by every render
+_PDF_CONFIG = config.Configuration(background_policy=config.BackgroundPolicy.WHITE)
+
 
 class SurveyDXFManager:
+    # layer-only dxfattribs, shared by every entity drawn on the layer; ezdxf copies dxfattribs into
+    # each entity, so one dict (these, or one built per batch) is reused for a whole run of entities
+    _LAYER_ATTRIBS = {layer: {'layer': layer} for layer in (
+        'BEACONS', 'PARCELS', 'LABELS', 'FRAME', 'TITLE_BLOCK', 'FOOTER', 'BOUNDARY', 'CONTOUR_MAJOR',
+        'CONTOUR_MINOR', 'CONTOUR_LABELS', 'TIN_MESH', 'GRID_MESH', 'SPOT_HEIGHTS')}
+
     def __init__(self, plan_name: str = "Survey Plan", scale: float = 1.0):
         self.plan_name = plan_name
-        self.scale = scale
+        self.scale = float(scale)
         self.doc = ezdxf.new(dxfversion="R2010")
         self.msp = self.doc.modelspace()
         self._setup_layers()
 
+        # PDF render context, reset whenever layers or text styles change
+        self._render_context = None
+
 
         # set units
         self.doc.header["$INSUNITS"] = 6  # meters
@@ -34,6 +72,17 @@ class SurveyDXFManager:
         self.doc.header["$AUPREC"] = 3 # 0d00'00"
         self.doc.header["$ANGBASE"] = 90.0  # set 0° direction to North
 
+    def _scale_points(self, points, dims: Optional[int] = None) -> np.ndarray:
+        """Points as a float array in drawing units, optionally keeping only the first `dims` columns"""
+        points = np.asarray(points, dtype=np.float64)
+        if dims is not None:
+            points = points[:, :dims]
+        return points * self.scale
+
+    def _layer_attribs(self, layer: str) -> dict:
+        """Layer-only dxfattribs, falling back to a fresh dict for layers outside the standard set"""
+        return self._LAYER_ATTRIBS.get(layer) or {'layer': layer}
+
     def _setup_layers(self):
         """Setup standard survey layers"""
         self.doc.layers.add(name="BEACONS", color=colors.BLACK)
@@ -57,7 +106,7 @@ class SurveyDXFManager:
     def setup_beacon_style(self, type_: str = "box", size: float = 1.0):
         size = size * self.scale
 
-        # Point styles (using blocks)
+        # Point styles (using blocks); the block geometry is pre-scaled, inserts only translate it
         block = self.doc.blocks.new(name='BEACON_POINT')
         radius = size * 0.2  # inner hatch radius
         half = size / 2  # half-size for square
@@ -101,48 +150,38 @@ class SurveyDXFManager:
     def setup_font(self, font_name: str = "Times New Roman"):
         # Add a new text style with the specified font
         self.doc.styles.add('SURVEY_TEXT', font=f'{font_name}.ttf')
-
-    def draw_beacon(self, x: float, y: float, z: float = 0, text_height: float = 1.0, extent: float = 1000, label=None):
-        # Add a beacon point with optional label
-        x = x * self.scale
-        y = y * self.scale
-        z = z * self.scale
-        text_height = text_height * self.scale
-
-        self.msp.add_blockref(
-            'BEACON_POINT',
-            (x, y, z),
-            dxfattribs={'layer': 'BEACONS'}
-        )
-
-        # add label
-        if label is not None:
-            offset = self.scale * extent * 0.01
-            self.msp.add_text(
-                label,
-                dxfattribs={
-                    'layer': 'LABELS',
-                    'height': text_height,
-                    'style': 'SURVEY_TEXT'
-                }
-            ).set_placement(
-                (x + offset, y + offset)
-            )
-
-    def add_parcel(self, parcel_id: str, points: List[Tuple[float, float]], label_size: float = 1.0):
-        """Add a parcel given its ID and list of (x, y) points"""
-        # scale points
-        points = [(x * self.scale, y * self.scale) for x, y, *rest in points]
+        self._render_context = None
+
+    def draw_beacons(self, xs, ys, labels: List[Optional[str]], text_height: float = 1.0, extent: float = 1000):
+        """Insert the BEACON_POINT block at every (xs[i], ys[i]) with its label, in a single pass"""
+        scale = self.scale
+        points = np.column_stack((np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64))) * scale
+        offset = scale * extent * 0.01
+
+        add_blockref = self.msp.add_blockref
+        add_text = self.msp.add_text
+        beacon_attribs = self._LAYER_ATTRIBS['BEACONS']
+        label_attribs = {'layer': 'LABELS', 'height': text_height * scale, 'style': 'SURVEY_TEXT'}
+
+        for (x, y), label_point, label in zip(points.tolist(), (points + offset).tolist(), labels):
+            add_blockref('BEACON_POINT', (x, y, 0), dxfattribs=beacon_attribs)
+
+            if label is not None:
+                # left aligned, so the insert point is the whole placement
+                label_attribs['insert'] = label_point
+                add_text(label, dxfattribs=label_attribs)
+
+    def add_parcel(self, parcel_id: str, points: List[Tuple[float, float]], label_size: float = 1.0, centroid: Optional[Tuple[float, float]] = None):
+        """Add a parcel given its ID and (N, 2) array or list of (x, y) points, and optionally its centroid"""
+        # scale points, dropping any elevation column
+        points = self._scale_points(points, dims=2)
         label_size = label_size * self.scale
 
-        self.msp.add_lwpolyline(points, close=True, dxfattribs={
-            'layer': 'PARCELS'
-        })
+        self.msp.add_lwpolyline(points, format='xy', close=True, dxfattribs=self._LAYER_ATTRIBS['PARCELS'])
 
         # Add parcel ID label at centroid
-        # if points and parcel_id:
-        #     centroid_x = sum(p[0] for p in points) / len(points)
-        #     centroid_y = sum(p[1] for p in points) / len(points)
+        # if centroid is not None and parcel_id:
+        #     centroid_x, centroid_y = centroid[0] * self.scale, centroid[1] * self.scale
         #     self.msp.add_text(
         #         parcel_id,
         #         dxfattribs={
@@ -157,18 +196,17 @@ class SurveyDXFManager:
         #     )
 
     def add_boundary(self, points: List[Tuple[float, float]]):
-        """Add a boundaty given its ID and list of (x, y) points"""
-        # scale points
-        points = [(x * self.scale, y * self.scale) for x, y, *rest in points]
+        """Add a boundaty given its ID and (N, 2) array or list of (x, y) points"""
+        # scale points, dropping any elevation column
+        points = self._scale_points(points, dims=2)
 
-        self.msp.add_lwpolyline(points, close=True, dxfattribs={
-            'layer': 'BOUNDARY'
-        })
+        self.msp.add_lwpolyline(points, format='xy', close=True, dxfattribs=self._LAYER_ATTRIBS['BOUNDARY'])
 
     def add_text(self, text: str, x: float, y: float, angle: float = 0.0, height: float = 1.0):
-        x = x * self.scale
-        y = y * self.scale
-        height = height * self.scale
+        scale = self.scale
+        x = x * scale
+        y = y * scale
+        height = height * scale
 
         """Add arbitrary text at given coordinates with optional rotation"""
         text = self.msp.add_text(
@@ -184,6 +222,19 @@ class SurveyDXFManager:
             align=TextEntityAlignment.MIDDLE_CENTER
         )
 
+    def add_texts(self, records: List[Tuple[str, float, float, float, float]]):
+        """Add many labels in one pass, each record is (text, x, y, angle, height)"""
+        scale = self.scale
+        add_text = self.msp.add_text
+        attribs = {'layer': 'LABELS', 'style': 'SURVEY_TEXT'}
+        for text, x, y, angle, height in records:
+            attribs['height'] = height * scale
+            attribs['rotation'] = angle
+            add_text(text, dxfattribs=attribs).set_placement(
+                (x * scale, y * scale),
+                align=TextEntityAlignment.MIDDLE_CENTER
+            )
+
     def draw_north_arrow(self, x: float, y: float, height: float = 100.0):
         height = height * self.scale
         x = x * self.scale
@@ -229,11 +280,12 @@ class SurveyDXFManager:
         )
 
     def add_north_arrow_label(self, start: Tuple[float, float], stop: Tuple[float, float], label: str = "", height: float = 100.0):
-        height = height * self.scale
-        x = start[0] * self.scale
-        y = start[1] * self.scale
-        stop_x = stop[0] * self.scale
-        stop_y = stop[1] * self.scale
+        scale = self.scale
+        height = height * scale
+        x = start[0] * scale
+        y = start[1] * scale
+        stop_x = stop[0] * scale
+        stop_y = stop[1] * scale
 
         # add line
         self.msp.add_line((x, y), (stop_x, stop_y), dxfattribs={'color': 5})
@@ -267,12 +319,19 @@ class SurveyDXFManager:
         self.msp.add_line((x, y - half), (x, y + half), dxfattribs={'color': 5})
 
     def draw_graphical_scale(self, x: float, y: float, length: float = 1000.0):
-        X = x * self.scale
-        Y = y * self.scale
-        length = length * self.scale
+        scale = self.scale
+        X = x * scale
+        Y = y * scale
+        length = length * scale
         height = length * 0.05  # 5% of length
 
+        # invariants of the drawing loop
+        half_height = height / 2
+        line_height = height * 1.5
+        text_y = height * 2.3
         interval = length / 5  # 5 intervals
+        line_attribs = {'color': 7}  # Black/White
+        text_attribs = {'height': height * 0.5, 'color': 7, 'style': 'SURVEY_TEXT'}
 
         # Create a block for the graphical scale
         block = self.doc.blocks.new(name='GRAPHICAL_SCALE')
@@ -281,28 +340,19 @@ class SurveyDXFManager:
         block.add_lwpolyline(
             [(0, 0), (length, 0), (length, height), (0, height)],
             close=True,
-            dxfattribs={'color': 7}  # Black/White
+            dxfattribs=line_attribs
         )
 
         # draw middle line
-        block.add_line(
-            (0, height / 2),
-            (length, height / 2),
-            dxfattribs={'color': 7}
-        )
+        block.add_line((0, half_height), (length, half_height), dxfattribs=line_attribs)
 
-        text_interval = 1000 / self.scale / 10 / 5
+        text_interval = 1000 / scale / 10 / 5
 
         # draw interval lines
         to_shade = "up"
         for i in range(6):
             x = i * interval
-            line_height = height * 1.5
-            block.add_line(
-                (x, 0),
-                (x, line_height),
-                dxfattribs={'color': 7}
-            )
+            block.add_line((x, 0), (x, line_height), dxfattribs=line_attribs)
 
             text = f"{int((i - 1) * text_interval)}"
             alignment = TextEntityAlignment.TOP_CENTER
@@ -314,62 +364,41 @@ class SurveyDXFManager:
                 alignment = TextEntityAlignment.TOP_LEFT
 
             # add text above line
-            block.add_text(
-                text,
-                dxfattribs={
-                    'height': height * 0.5,
-                    'color': 7,
-                    'style': 'SURVEY_TEXT'
-                }
-            ).set_placement(
-                (x, height * 2.3),
-                align=alignment
-            )
+            block.add_text(text, dxfattribs=text_attribs).set_placement((x, text_y), align=alignment)
 
             if i == 5:
                 continue
 
+            # the first interval is shaded in two halves, the others whole
             if i == 0:
-                mini_interval = interval / 2
-                for j in range(2):
-                    mini_x = j * mini_interval
-                    if to_shade == "up":
-                        # shade first upper half
-                        hatch = block.add_hatch(color=7)
-                        hatch.paths.add_polyline_path([(mini_x, height / 2), (mini_x + mini_interval, height / 2),
-                                                       (mini_x + mini_interval, height), (mini_x, height)])
-                        to_shade = "down"
-                    else:
-                        # shade lower half
-                        hatch = block.add_hatch(color=7)
-                        hatch.paths.add_polyline_path(
-                            [(mini_x, 0), (mini_x + mini_interval, 0), (mini_x + mini_interval, height / 2),
-                             (mini_x, height / 2)])
-                        to_shade = "up"
+                segments = ((0, interval / 2), (interval / 2, interval))
             else:
+                segments = ((x, x + interval),)
+
+            for x0, x1 in segments:
+                hatch = block.add_hatch(color=7)
                 if to_shade == "up":
-                    hatch = block.add_hatch(color=7)
-                    hatch.paths.add_polyline_path(
-                        [(x, height / 2), (x + interval, height / 2), (x + interval, height), (x, height)])
+                    # shade upper half
+                    hatch.paths.add_polyline_path([(x0, half_height), (x1, half_height), (x1, height), (x0, height)])
                     to_shade = "down"
                 else:
-                    hatch = block.add_hatch(color=7)
-                    hatch.paths.add_polyline_path(
-                        [(x, 0), (x + interval, 0), (x + interval, height / 2), (x, height / 2)])
+                    # shade lower half
+                    hatch.paths.add_polyline_path([(x0, 0), (x1, 0), (x1, half_height), (x0, half_height)])
                     to_shade = "up"
 
         return self.msp.add_blockref(
             'GRAPHICAL_SCALE',
             (X, Y),
-            dxfattribs={'layer': 'TITLE_BLOCK'}
+            dxfattribs=self._LAYER_ATTRIBS['TITLE_BLOCK']
         )
 
     def draw_title_block(self, text: str, x: float, y: float, width: float, title_height: float = 1.0, graphical_scale_length: float = 1000.0, origin: str = "", area: str = ""):
-        x = x * self.scale
-        y = y * self.scale
-        title_height = title_height * self.scale
-        width = width * self.scale
-        graphical_scale_length = graphical_scale_length * self.scale
+        scale = self.scale
+        x = x * scale
+        y = y * scale
+        title_height = title_height * scale
+        width = width * scale
+        graphical_scale_length = graphical_scale_length * scale
 
         block = self.doc.blocks.new(name='TITLE_BLOCK')
         title_mtext = block.add_mtext(
@@ -381,24 +410,20 @@ class SurveyDXFManager:
         title_mtext.dxf.width = width
 
         # add block to modelspace
-        title_ref = self.msp.add_blockref(
+        self.msp.add_blockref(
             'TITLE_BLOCK',
             (x, y),
-            dxfattribs={'layer': 'TITLE_BLOCK'}
+            dxfattribs=self._LAYER_ATTRIBS['TITLE_BLOCK']
         )
 
-        title_box = bbox.extents(title_ref.virtual_entities())
-        title_min_y = title_box.extmin.y
-        title_min_x = title_box.extmin.x
-        title_max_x = title_box.extmax.x
-
-        title_length = title_max_x - title_min_x
-        graphical_x = title_min_x + ((title_length / 2) - (graphical_scale_length / 2))
+        # the title is centred on x across the column width; only its depth depends on the
+        # text layout, so measure the MTEXT alone (block-relative) instead of the reference
+        title_min_y = y + bbox.extents([title_mtext]).extmin.y
+        graphical_x = x - (graphical_scale_length / 2)
 
-        # draw graphical scale below title
-        graphical_ref = self.draw_graphical_scale(graphical_x / self.scale, (title_min_y - (graphical_scale_length * 0.05 * 3)) / self.scale, graphical_scale_length / self.scale)
-        graphical_box = bbox.extents(graphical_ref.virtual_entities())
-        graphical_min_y = graphical_box.extmin.y
+        # draw graphical scale below title; its lowest entity sits on the insert point
+        graphical_min_y = title_min_y - (graphical_scale_length * 0.05 * 3)
+        self.draw_graphical_scale(graphical_x / scale, graphical_min_y / scale, graphical_scale_length / scale)
 
         origin_mtext = self.msp.add_mtext(
             text=f"{MTextEditor.UNDERLINE_START}\C5;{area}{MTextEditor.NEW_LINE}\C1;{origin}{MTextEditor.UNDERLINE_STOP}",
@@ -410,11 +435,12 @@ class SurveyDXFManager:
         origin_mtext.set_location((x, graphical_min_y - ((graphical_scale_length * 0.05) / 3)))
 
     def draw_footer_box(self, text: str, min_x, min_y, max_x, max_y, font_size: float = 1.0):
-        font_size = font_size * self.scale
-        min_x = min_x * self.scale
-        min_y = min_y * self.scale
-        max_x = max_x * self.scale
-        max_y = max_y * self.scale
+        scale = self.scale
+        font_size = font_size * scale
+        min_x = min_x * scale
+        min_y = min_y * scale
+        max_x = max_x * scale
+        max_y = max_y * scale
 
         """Draw a rectangle given min and max coordinates"""
         self.msp.add_lwpolyline([
@@ -422,9 +448,7 @@ class SurveyDXFManager:
             (max_x, min_y),
             (max_x, max_y),
             (min_x, max_y)
-        ], close=True, dxfattribs={
-            'layer': 'FOOTER',
-        })
+        ], format='xy', close=True, dxfattribs=self._LAYER_ATTRIBS['FOOTER'])
 
         # add text inside box
         footer_mtext = self.msp.add_mtext(
@@ -442,10 +466,11 @@ class SurveyDXFManager:
         footer_mtext.dxf.char_height = font_size
 
     def draw_frame(self, min_x, min_y, max_x, max_y):
-        min_x = min_x * self.scale
-        min_y = min_y * self.scale
-        max_x = max_x * self.scale
-        max_y = max_y * self.scale
+        scale = self.scale
+        min_x = min_x * scale
+        min_y = min_y * scale
+        max_x = max_x * scale
+        max_y = max_y * scale
 
         """Draw a rectangle given min and max coordinates"""
         self.msp.add_lwpolyline([
@@ -453,71 +478,53 @@ class SurveyDXFManager:
             (max_x, min_y),
             (max_x, max_y),
             (min_x, max_y)
-        ], close=True, dxfattribs={
-            'layer': 'FRAME',
-        })
-
-    def draw_topo_point(self, x: float, y: float, z: float = 0, label: str = None, text_height: float = 1.0):
-        # Add a topo point with optional label
-        x = x * self.scale
-        y = y * self.scale
-        z = z * self.scale
-        text_height = text_height * self.scale
-
-        self.msp.add_blockref(
-            'TOPO_POINT',
-            (x, y, z),
-            dxfattribs={'layer': 'SPOT_HEIGHTS'}
-        )
-
-        # add label
-        if label is not None:
-            offset = 0.25 * text_height
-            self.msp.add_text(
-                label,
-                dxfattribs={
-                    'layer': 'SPOT_HEIGHTS',
-                    'height': text_height,
-                    'style': 'Standard',
-                    'color': 7  # Black/White
-                }
-            ).set_placement(
-                (x + offset, y + offset, z + offset)
-            )
-
-    def add_tin_mesh(self, points: List[Tuple[float, float, float]]):
-        points = [(x * self.scale, y * self.scale, z * self.scale) for x, y, z in points]
-
-        # Add as 3D polyline
-        self.msp.add_polyline3d(
-            points,
-            dxfattribs={'layer': 'TIN_MESH'}
-        )
-
-    def add_grid_mesh(self, points: List[Tuple[float, float, float]]):
-        points = [(x * self.scale, y * self.scale, z * self.scale) for x, y, z in points]
-
-        # Add as 3D polyline
-        self.msp.add_polyline3d(
-            points,
-            dxfattribs={'layer': 'GRID_MESH'}
-        )
-
-    def add_grid_mesh_label(self, x: float, y: float, z: float, label: str, text_height: float = 1.0, rotation: float = 0.0):
-        x = x * self.scale
-        y = y * self.scale
-        z = z * self.scale
-        text_height = text_height * self.scale
-
-        self.msp.add_text(label, dxfattribs={
-            "layer": "GRID_MESH",
-            "height": text_height,
-            "style": "Standard",
-            "rotation": rotation
-        }).set_placement((x, y, z),)
+        ], format='xy', close=True, dxfattribs=self._LAYER_ATTRIBS['FRAME'])
+
+    def draw_topo_points(self, xs, ys, zs, labels: List[Optional[str]], text_height: float = 1.0):
+        """Insert the TOPO_POINT block at every (xs[i], ys[i], zs[i]) with its label, in a single pass"""
+        scale = self.scale
+        points = self._scale_points(np.column_stack((xs, ys, zs)))
+        text_height = text_height * scale
+        offset = 0.25 * text_height
+
+        add_blockref = self.msp.add_blockref
+        add_text = self.msp.add_text
+        point_attribs = self._LAYER_ATTRIBS['SPOT_HEIGHTS']
+        label_attribs = {'layer': 'SPOT_HEIGHTS', 'height': text_height, 'style': 'Standard', 'color': 7}  # Black/White
+
+        for point, label_point, label in zip(points.tolist(), (points + offset).tolist(), labels):
+            add_blockref('TOPO_POINT', point, dxfattribs=point_attribs)
+
+            if label is not None:
+                label_attribs['insert'] = label_point
+                add_text(label, dxfattribs=label_attribs)
+
+    def add_tin_mesh(self, vertices, faces):
+        """Add a TIN given its (N, 3) vertices and (M, 3) triangle vertex indices"""
+        mesh = MeshBuilder()
+        mesh.vertices = Vec3.list(self._scale_points(vertices).tolist())
+        mesh.faces = np.asarray(faces).tolist()
+
+        # Add as a single polyface mesh, triangles share their vertices
+        mesh.render_polyface(self.msp, dxfattribs=self._LAYER_ATTRIBS['TIN_MESH'])
+
+    def add_grid_mesh_lines(self, starts, ends):
+        """Add a grid line from every starts[i] to ends[i], both (N, 3) arrays, in a single pass"""
+        add_polyline3d = self.msp.add_polyline3d
+        attribs = self._LAYER_ATTRIBS['GRID_MESH']
+        for start, end in zip(self._scale_points(starts).tolist(), self._scale_points(ends).tolist()):
+            add_polyline3d((start, end), dxfattribs=attribs)
+
+    def add_grid_mesh_labels(self, points, labels: List[str], text_height: float = 1.0, rotation: float = 0.0):
+        """Add a grid label at every (x, y, z) row of points, in a single pass"""
+        add_text = self.msp.add_text
+        attribs = {"layer": "GRID_MESH", "height": text_height * self.scale, "style": "Standard", "rotation": rotation}
+        for point, label in zip(self._scale_points(points).tolist(), labels):
+            attribs["insert"] = point
+            add_text(label, dxfattribs=attribs)
 
     def add_grid_mesh_border(self, points: List[Tuple[float, float, float]]):
-        points = [(x * self.scale, y * self.scale, z * self.scale) for x, y, z in points]
+        points = self._scale_points(points)
 
         self.msp.add_polyline3d(
             points,
@@ -528,126 +535,156 @@ class SurveyDXFManager:
         )
 
     def add_grid_mesh_corner_coords(self, x: float, y: float, z: float, label: str, text_height: float = 1.0, rotation: float = 0.0):
-        x = x * self.scale
-        y = y * self.scale
-        z = z * self.scale
-        text_height = text_height * self.scale
+        scale = self.scale
+        x = x * scale
+        y = y * scale
+        z = z * scale
+        text_height = text_height * scale
 
         self.msp.add_text(label, dxfattribs={
             "layer": "GRID_MESH",
             "height": text_height,
             "style": "Standard",
-            "rotation": rotation
-        }).set_placement((x, y, z),)
-
-    def add_3d_contour(self, points: List[Tuple[float, float, float]], layer = "CONTOUR_MINOR"):
-        points = [(x * self.scale, y * self.scale, z * self.scale) for x, y, z in points]
-
-        # Add as 3D polyline
-        self.msp.add_polyline3d(
-            points,
-            dxfattribs={'layer': layer}
-        )
-
-    def add_contour_label(self, x: float, y: float, z: float, label: str, text_height: float = 1.0):
-        x = x * self.scale
-        y = y * self.scale
-        z = z * self.scale
-        text_height = text_height * self.scale
+            "rotation": rotation,
+            "insert": (x, y, z),
+        })
 
-        self.msp.add_text(label, dxfattribs={
-            "layer": "CONTOUR_LABELS",
-            "height": text_height,
-        }).set_placement((x, y, z), align=TextEntityAlignment.MIDDLE_CENTER)
+    def add_3d_contours(self, paths, elevation: float, layer="CONTOUR_MINOR"):
+        """Add the (N, 2) contour paths of one elevation, as splines where they are long enough to smooth"""
+        # empty paths would shift the per-path starts onto the next path's first vertex
+        paths = [path for path in paths if len(path)]
+        counts = [len(path) for path in paths]
+        if not counts:
+            return
 
-    def add_spline(self, points: List[Tuple[float, float, float]], layer="CONTOUR_MINOR"):
-        points = [(x * self.scale, y * self.scale, z * self.scale) for x, y, z in points]
+        # all paths of the level are lifted to the elevation and scaled in one go
+        points = np.empty((sum(counts), 3))
+        points[:, :2] = np.concatenate(paths)
+        points[:, 2] = elevation
+
+        # drop vertices repeating the one before them (where a level runs through grid nodes),
+        # a spline through repeated fit points has a singular fit and cannot be drawn
+        starts = np.cumsum(counts) - counts
+        keep = np.ones(len(points), dtype=bool)
+        np.any(points[1:] != points[:-1], axis=1, out=keep[1:])
+        keep[starts] = True
+        counts = np.add.reduceat(keep, starts, dtype=np.intp)
+        points = self._scale_points(points[keep])
+
+        attribs = self._layer_attribs(layer)
+        for path in np.split(points, np.cumsum(counts)[:-1]):
+            if len(path) < 2:
+                continue
+            if len(path) < 4:
+                # For short segments, use a simple polyline
+                self.msp.add_polyline3d(path, dxfattribs=attribs)
+            else:
+                self.msp.add_spline(path, degree=3, dxfattribs=attribs)
 
-        # Add as 3D polyline
-        self.msp.add_spline(
-            points,
-            degree=3,
-            dxfattribs={'layer': layer}
-        )
+    def add_contour_labels(self, points, elevation: float, label: str, text_height: float = 1.0):
+        """Add the label of one elevation at every (x, y) row of points, in a single pass"""
+        scale = self.scale
+        z = elevation * scale
+        add_text = self.msp.add_text
+        attribs = {"layer": "CONTOUR_LABELS", "height": text_height * scale}
+        for x, y in self._scale_points(points, dims=2).tolist():
+            add_text(label, dxfattribs=attribs).set_placement((x, y, z), align=TextEntityAlignment.MIDDLE_CENTER)
 
     def toggle_layer(self, layer: str, state: bool):
         """Toggle the visibility of a layer"""
         layer_ = self.doc.layers.get(layer)
         layer_.off() if state is False else layer_.on()
+        self._render_context = None
 
     def get_filename(self):
-        plan_name = self.plan_name.lower()
-        plan_name = re.sub(r"\s+", "_",plan_name)
-        plan_name = re.sub(r"[^a-z0-9._-]", "", plan_name)
-        plan_name = re.sub(r"_+", "_", plan_name)
-        return f"{plan_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        # the stem is cached per plan name, the suffix keeps every file name unique
+        return f"{_file_stem(self.plan_name)}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
 
-    def save_dxf(self, filepath: str = None):
-        """Save the DXF document to a file"""
-        if filepath:
-            self.doc.saveas(filepath)
-            return
-        dxf_path = f"{self.get_filename()}.dxf"
-        self.doc.saveas(dxf_path)
+    def _serialize(self) -> bytes:
+        """Serialize the DXF document once, in the document's output encoding"""
+        stream = io.StringIO()
+        self.doc.write(stream)
+        return self.doc.encode(stream.getvalue())
 
-    def save_pdf(self, filepath: str = None, paper_size: str = "A4", orientation: str = "portrait"):
-        # Paper sizes in mm
-        paper_sizes = {
-            "A4": (210, 297),
-            "A3": (297, 420),
-            "A5": (148, 210),
-            "Letter": (216, 279),
-            "Legal": (216, 356),
-        }
+    def save_dxf(self, filepath: str = None, data: bytes = None):
+        """Save the DXF document to a file"""
+        if not filepath:
+            filepath = f"{self.get_filename()}.dxf"
+        if data is None:
+            data = self._serialize()
+        with open(filepath, "wb") as f:
+            f.write(data)
 
+    def _render_pdf(self, paper_size: str = "A4", orientation: str = "portrait") -> bytes:
         # Default to A4 if not found
-        width, height = paper_sizes.get(paper_size.upper(), (210, 297))
+        width, height = PAPER_SIZES.get(paper_size.upper(), (210, 297))
 
         # Apply orientation
         if orientation.lower() == "landscape":
             width, height = height, width
 
-        # Rendering
-        context = RenderContext(self.doc)
+        # Rendering; the context snapshots layers, linetypes and text styles, so it is
+        # reused until one of those changes
+        if self._render_context is None:
+            self._render_context = RenderContext(self.doc)
         backend = pymupdf.PyMuPdfBackend()
-        cfg = config.Configuration(background_policy=config.BackgroundPolicy.WHITE)
-        frontend = Frontend(context, backend, config=cfg)
+        frontend = Frontend(self._render_context, backend, config=_PDF_CONFIG)
         frontend.draw_layout(self.msp)
 
         # Create page with margins (20 mm here, can be parameterized)
         page = layout.Page(width, height, layout.Units.mm, margins=layout.Margins.all(20))
+        return backend.get_pdf_bytes(page)
 
+    def save_pdf(self, filepath: str = None, paper_size: str = "A4", orientation: str = "portrait"):
         # Output path
         if not filepath:
             filepath = f"{self.get_filename()}.pdf"
 
         # Save PDF
-        pdf_bytes = backend.get_pdf_bytes(page)
+        pdf_bytes = self._render_pdf(paper_size=paper_size, orientation=orientation)
         with open(filepath, "wb") as f:
             f.write(pdf_bytes)
 
     def save_dwg(self, dxf_filepath: str, filepath: str = None):
         if not filepath:
             filepath = f"{self.get_filename()}.dwg"
-        odafc.convert(dxf_filepath, filepath)
+        # the DXF is ezdxf's own output, so the converter's audit pass has nothing to repair
+        odafc.convert(dxf_filepath, filepath, audit=False)
 
-    def save(self, paper_size: str = "A4", orientation: str = "portrait"):
+    def save(self, paper_size: str = "A4", orientation: str = "portrait", formats: Tuple[str, ...] = ("dxf", "dwg", "pdf")):
         with tempfile.TemporaryDirectory() as tmpdir:
             filename = self.get_filename()
             dxf_path = os.path.join(tmpdir, f"{filename}.dxf")
             dwg_path =  os.path.join(tmpdir, f"{filename}.dwg")
-            pdf_path =  os.path.join(tmpdir, f"{filename}.pdf")
             zip_path = os.path.join(tmpdir, f"{filename}.zip")
 
-            self.save_dxf(dxf_path)
-            self.save_dwg(dxf_path, dwg_path)
-            self.save_pdf(pdf_path, paper_size=paper_size, orientation=orientation)
-
-            # Create a ZIP file containing all three formats
-            with zipfile.ZipFile(zip_path, "w") as zipf:
-                zipf.write(dxf_path, os.path.basename(dxf_path))
-                zipf.write(dwg_path, os.path.basename(dwg_path))
-                zipf.write(pdf_path, os.path.basename(pdf_path))
+            # serialize the DXF once; the converter reads the file, the zip reuses the bytes
+            dxf_bytes = self._serialize()
+            if "dwg" in formats:
+                self.save_dxf(dxf_path, data=dxf_bytes)
+
+            # Create a ZIP file containing the requested formats; only the ASCII DXF is worth
+            # deflating (fast level), the DWG and PDF are already compressed
+            with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_STORED) as zipf:
+                # the ODA converter runs as a separate process and zlib releases the GIL, so
+                # the DWG conversion and the DXF entry run alongside the PDF render
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    jobs = []
+                    if "dwg" in formats:
+                        jobs.append(pool.submit(self.save_dwg, dxf_path, dwg_path))
+                    if "dxf" in formats:
+                        jobs.append(pool.submit(zipf.writestr, f"{filename}.dxf", dxf_bytes,
+                                                compress_type=zipfile.ZIP_DEFLATED, compresslevel=1))
+                    pdf_bytes = None
+                    if "pdf" in formats:
+                        pdf_bytes = self._render_pdf(paper_size=paper_size, orientation=orientation)
+                    for job in jobs:
+                        job.result()
+
+                if "dwg" in formats:
+                    zipf.write(dwg_path, os.path.basename(dwg_path))
+                if pdf_bytes is not None:
+                    zipf.writestr(f"{filename}.pdf", pdf_bytes)
 
             url = upload_file(zip_path, folder="survey_plans", file_name=filename)
             if url is None:
@@ -0,0 +1,12 @@
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+
+# Plan drawing runs in the app's process pool (PLAN_WORKERS), so the web workers
+# only wait on it; threads keep them responsive while plans are generated.
+# Background jobs live in the worker's memory, keep a single worker unless
+# /jobs polling is routed back to the same process.
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
@@ -1,8 +1,11 @@
+import html
 from enum import Enum
+from functools import cached_property
 from typing import List, Optional, Union
 from datetime import datetime
-from pydantic import BaseModel, Field
-from bs4 import BeautifulSoup
+from pydantic import BaseModel, ConfigDict, Field
+
+import numpy as np
 
 # ---------- Enums ----------
 class PlanType(str, Enum):
@@ -31,18 +34,24 @@ class PageOrientation(str, Enum):
 
 # ---------- Supporting models ----------
 class CoordinateProps(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str = ""
     northing: Optional[float] = 0.0
     easting: Optional[float] = 0.0
     elevation: Optional[float] = 0.0
 
 class BearingProps(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     degrees: Optional[int] = 0.0
     minutes: Optional[int] = 0.0
     seconds: Optional[float] = 0.0
     decimal: Optional[float] = 0.0
 
 class TraverseLegProps(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     from_: CoordinateProps = Field(alias="from")  # 👈 use alias
     to: CoordinateProps
     bearing: Optional[BearingProps] = None
@@ -56,6 +65,8 @@ class ParcelProps(BaseModel):
     legs: List[TraverseLegProps] = []
 
 class ElevationProps(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str
     elevation: float
     chainage: str
@@ -130,43 +141,65 @@ class PlanProps(BaseModel):
         extent = max(width, height)
         return extent
 
+    @cached_property
+    def _coordinate_arrays(self) -> tuple:
+        # eastings, northings and elevations of the survey points as parallel
+        # arrays, built once (coordinates are not mutated after validation)
+        coordinates = self.coordinates or []
+        eastings = np.fromiter((c.easting for c in coordinates), dtype=np.float64, count=len(coordinates))
+        northings = np.fromiter((c.northing for c in coordinates), dtype=np.float64, count=len(coordinates))
+        elevations = np.array([c.elevation for c in coordinates], dtype=np.float64)  # missing -> nan
+        return eastings, northings, elevations
+
+    @cached_property
+    def _coordinate_index(self) -> dict:
+        # point id -> row in the coordinate arrays
+        return {coord.id: i for i, coord in enumerate(self.coordinates or [])}
+
+    @cached_property
+    def _boundary_arrays(self) -> tuple:
+        # eastings and northings of the topographic boundary points, built once
+        boundary = self.topographic_boundary.coordinates if self.topographic_boundary is not None else []
+        eastings = np.fromiter((p.easting for p in boundary), dtype=np.float64, count=len(boundary))
+        northings = np.fromiter((p.northing for p in boundary), dtype=np.float64, count=len(boundary))
+        return eastings, northings
+
+    @cached_property
+    def _xy_arrays(self) -> tuple:
+        # eastings/northings of every point the plan spans
+        xs, ys, _ = self._coordinate_arrays
+        if self.type == PlanType.TOPOGRAPHIC and self.topographic_boundary is not None:
+            boundary_xs, boundary_ys = self._boundary_arrays
+            xs = np.concatenate((xs, boundary_xs))
+            ys = np.concatenate((ys, boundary_ys))
+        return xs, ys
+
     def get_bounding_box(self) -> Optional[tuple]:
-        if len(self.coordinates) == 0:
+        if not self.coordinates:
             return None
 
-        xs = [p.easting for p in self.coordinates]
-        ys = [p.northing for p in self.coordinates]
-
-        if self.type == PlanType.TOPOGRAPHIC and self.topographic_boundary is not None:
-            xs += [p.easting for p in self.topographic_boundary.coordinates]
-            ys += [p.northing for p in self.topographic_boundary.coordinates]
-
-        min_x, max_x = min(xs), max(xs)
-        min_y, max_y = min(ys), max(ys)
+        xs, ys = self._xy_arrays
+        min_x, max_x = float(xs.min()), float(xs.max())
+        min_y, max_y = float(ys.min()), float(ys.max())
 
         return min_x, min_y, max_x, max_y
 
     def build_title(self) -> str:
-        soup = BeautifulSoup(self.title.upper(), "html.parser")
+        # the title is html already, wrapped so its unclosed tags end with it; the other
+        # lines are plain text in their own paragraphs
+        title = self.title.upper()
+        parts = [f"<div>{title}</div>"] if title.strip() else []
 
         if self.address:
-            p1 = soup.new_tag("p")
-            p1.string = self.address.upper()
-            soup.append(p1)
+            parts.append(f"<p>{html.escape(self.address.upper(), quote=False)}</p>")
 
         if self.local_govt:
-            p2 = soup.new_tag("p")
-            p2.string = self.local_govt.upper()
-            soup.append(p2)
+            parts.append(f"<p>{html.escape(self.local_govt.upper(), quote=False)}</p>")
 
         if self.state:
-            p3 = soup.new_tag("p")
-            p3.string = f"{self.state.upper()} STATE"
-            soup.append(p3)
+            parts.append(f"<p>{html.escape(self.state.upper(), quote=False)} STATE</p>")
 
         if self.scale:
-            p4 = soup.new_tag("p")
-            p4.string = f"SCALE :- 1 : {int(self.scale)}"
-            soup.append(p4)
+            parts.append(f"<p>SCALE :- 1 : {int(self.scale)}</p>")
 
-        return soup.prettify()
+        return "\n".join(parts)
@@ -0,0 +1,19 @@
+import pytest
+
+from utils import _soup_to_mtext, _stream_to_mtext, html_to_mtext
+
+
+@pytest.mark.parametrize("html_text, expected", [
+    ("<img src=x> <p class='x'>", "\\P"),
+    ("<hr><p><img src=x><u>&#169;", "\\P\\L©\\l"),
+    ("<b>x<wbr>y</b><p>z", "\\Bxy\\b\\Pz"),
+    ("<p>a</p><input><p>b", "a\\Pb"),
+])
+def test_void_elements_keep_paragraph_breaks(html_text, expected):
+    assert _stream_to_mtext(html_text) == expected
+    assert html_to_mtext(html_text) == str(_soup_to_mtext(html_text)).replace("\n", "") == expected
+
+
+def test_void_end_tags_fall_back_to_soup():
+    assert _stream_to_mtext("a<hr>b</hr>c") is None
+    assert html_to_mtext("a<hr>b</hr>c") == str(_soup_to_mtext("a<hr>b</hr>c"))
@@ -1,15 +1,13 @@
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-
 from pydantic import PrivateAttr
 from dxf import SurveyDXFManager
 from models.plan import PlanProps, PlanType
-from utils import polygon_orientation, line_normals, line_direction, html_to_mtext
-from scipy.interpolate import griddata, LinearNDInterpolator
+from utils import polygon_orientation, leg_label_records, html_to_mtext
+from scipy.interpolate import LinearNDInterpolator, CloughTocher2DInterpolator
 from scipy.ndimage import gaussian_filter
-from scipy.spatial import Delaunay
-from typing import List, Tuple, Optional
+from scipy.spatial import Delaunay, cKDTree
+from contourpy import contour_generator, LineType
+from typing import Optional
+from functools import cached_property
 
 import math
 import numpy as np
@@ -25,8 +23,10 @@ class TopographicPlan(PlanProps):
         self._frame_x_percent = 0.35
         self._frame_y_percent = 0.8
         self._bounding_box = self.get_bounding_box()
+        self._drawing_extent = self._get_drawing_extent()
         self._frame_coords = self._setup_frame_coords()
-        self._boundary_dict = {coord.id: coord for coord in self.topographic_boundary.coordinates}
+        self._border_coords = self._setup_frame_coords(padding=0.03)
+        self._boundary_index = {coord.id: i for i, coord in enumerate(self.topographic_boundary.coordinates)}
         if not self._frame_coords:
             raise ValueError("Cannot determine frame coordinates without valid coordinates.")
 
@@ -47,7 +47,7 @@ class TopographicPlan(PlanProps):
         drawer.setup_topo_point_style(type_="cross", size=0.5 * self.topographic_setting.point_label_scale)
         return drawer
 
-    def _setup_frame_coords(self):
+    def _setup_frame_coords(self, padding: float = 0.0):
         min_x, min_y, max_x, max_y = self._bounding_box
         if min_x is None or min_y is None or max_x is None or max_y is None:
             return None
@@ -55,8 +55,10 @@ class TopographicPlan(PlanProps):
         width = max_x - min_x
         height = max_y - min_y
 
-        margin_x = max(width, height) * self._frame_x_percent
-        margin_y = max(height, width) * self._frame_y_percent
+        # margins are proportional to the larger side of the bounding box
+        size = max(width, height)
+        margin_x = size * (self._frame_x_percent + padding)
+        margin_y = size * (self._frame_y_percent + padding)
 
         frame_left = min_x - margin_x
         frame_bottom = min_y - margin_y
@@ -69,9 +71,13 @@ class TopographicPlan(PlanProps):
         if not self.coordinates:
             return None
 
-        # list of tuples
-        pts = [(coord.easting, coord.northing, coord.elevation) for coord in self.coordinates]
-        return np.array(pts)
+        # (N, 3) easting/northing/elevation, from the plan's cached coordinate arrays
+        return np.column_stack(self._coordinate_arrays)
+
+    @cached_property
+    def _triangulation(self) -> Delaunay:
+        # one Delaunay triangulation of the survey points, shared by the TIN and grid surfaces
+        return Delaunay(np.column_stack([self._x, self._y]))
 
     def _get_drawing_extent(self) -> float:
         # get bounding box
@@ -88,108 +94,47 @@ class TopographicPlan(PlanProps):
         if not self.topographic_boundary:
             return
 
-        check = []
-        for coord in self.topographic_boundary.coordinates:
-            if coord.id in check:
-                continue
-            self._drawer.draw_beacon(coord.easting, coord.northing, 0, self.label_size, self._get_drawing_extent(), coord.id)
-            check.append(coord.id)
+        # row of the first occurrence of every beacon id, in boundary order
+        # (a closed boundary repeats its first beacon)
+        first = {}
+        for i, coord in enumerate(self.topographic_boundary.coordinates):
+            first.setdefault(coord.id, i)
+
+        idx = np.fromiter(first.values(), dtype=np.intp, count=len(first))
+        eastings, northings = self._boundary_arrays
+        self._drawer.draw_beacons(eastings[idx], northings[idx], list(first), self.label_size, self._drawing_extent)
 
     def draw_topo_points(self):
         if not self.coordinates:
             return
 
-        for coord in self.coordinates:
-            self._drawer.draw_topo_point(coord.easting, coord.northing, coord.elevation, f"{coord.elevation}", self.topographic_setting.point_label_scale)
+        labels = [f"{coord.elevation}" for coord in self.coordinates]
+        self._drawer.draw_topo_points(self._x, self._y, self._z, labels, self.topographic_setting.point_label_scale)
 
     def draw_boundary(self):
         if not self.topographic_boundary:
             return
 
-        boundary_points = [(coord.easting, coord.northing) for coord in self.topographic_boundary.coordinates]
-        if not boundary_points:
+        if not self.topographic_boundary.coordinates:
             return
 
-        (self._drawer.
-         add_boundary(boundary_points))
+        boundary_points = np.column_stack(self._boundary_arrays)
+
+        self._drawer.add_boundary(boundary_points)
         orientation = polygon_orientation(boundary_points)
 
-        for leg in self.topographic_boundary.legs:
-            self.add_leg_labels(leg, orientation)
-
-    def add_leg_labels(self, leg, orientation: str):
-        """Add distance and bearing labels to a leg."""
-        # Angle and positions
-        angle_rad = math.atan2(leg.to.northing - leg.from_.northing,
-                               leg.to.easting - leg.from_.easting)
-        angle_deg = math.degrees(angle_rad)
-
-        # Fractional positions
-        first_x = leg.from_.easting + (0.2 * (leg.to.easting - leg.from_.easting))
-        first_y = leg.from_.northing + (0.2 * (leg.to.northing - leg.from_.northing))
-        last_x = leg.from_.easting + (0.8 * (leg.to.easting - leg.from_.easting))
-        last_y = leg.from_.northing + (0.8 * (leg.to.northing - leg.from_.northing))
-        mid_x = (leg.from_.easting + leg.to.easting) / 2
-        mid_y = (leg.from_.northing + leg.to.northing) / 2
-
-        # Offset text above/below the line
-        normals = line_normals((leg.from_.easting, leg.from_.northing), (leg.to.easting, leg.to.northing), orientation)
-        offset_distance = self._get_drawing_extent() * 0.02
-        offset_inside_x = (normals[0][0] / math.hypot(*normals[0])) * offset_distance
-        offset_inside_y = (normals[0][1] / math.hypot(*normals[0])) * offset_distance
-        offset_outside_x = (normals[1][0] / math.hypot(*normals[1])) * offset_distance
-        offset_outside_y = (normals[1][1] / math.hypot(*normals[1])) * offset_distance
-
-        first_x += offset_outside_x
-        first_y += offset_outside_y
-        last_x += offset_outside_x
-        last_y += offset_outside_y
-        mid_x += offset_inside_x
-        mid_y += offset_inside_y
-
-        # Text angle adjustment
-        text_angle = angle_deg
-        if text_angle > 90 or text_angle < -90:
-            text_angle += 180
-
-        # Add labels
-        self._drawer.add_text(f"{leg.distance:.2f} m", mid_x, mid_y,
-                              angle=text_angle, height=self.label_size)
-        ld = line_direction(angle_deg)
-        if ld == "left → right":
-            self._drawer.add_text(f"{leg.bearing.degrees}°", first_x, first_y,
-                                  angle=text_angle, height=self.label_size)
-            self._drawer.add_text(f"{leg.bearing.minutes}'", last_x, last_y,
-                                  angle=text_angle, height=self.label_size)
-        else:
-            self._drawer.add_text(f"{leg.bearing.degrees}°", last_x, last_y,
-                                  angle=text_angle, height=self.label_size)
-            self._drawer.add_text(f"{leg.bearing.minutes}'", first_x, first_y,
-                                  angle=text_angle, height=self.label_size)
+        offset_distance = self._drawing_extent * 0.02
+        self._drawer.add_texts(leg_label_records(self.topographic_boundary.legs, orientation, offset_distance, self.label_size))
 
     def draw_frames(self):
         """Draw outer and offset frames."""
-        min_x, min_y, max_x, max_y = self._bounding_box
-        width, height = max_x - min_x, max_y - min_y
-
-        margin_x, margin_y = max(width, height) * self._frame_x_percent, max(height, width) * self._frame_y_percent
-        frame_left, frame_bottom = min_x - margin_x, min_y - margin_y
-        frame_right, frame_top = max_x + margin_x, max_y + margin_y
-        self._drawer.draw_frame(frame_left, frame_bottom, frame_right, frame_top)
-
-        offset_x, offset_y = max(width, height) * (self._frame_x_percent + 0.03), max(height, width) * (
-                    self._frame_y_percent + 0.03)
-        self._drawer.draw_frame(min_x - offset_x, min_y - offset_y,
-                                max_x + offset_x, max_y + offset_y)
+        self._drawer.draw_frame(*self._frame_coords)
+        self._drawer.draw_frame(*self._border_coords)
 
     def draw_title_block(self):
         """Add title block to the frame."""
-        min_x, min_y, max_x, max_y = self._bounding_box
-        width, height = max_x - min_x, max_y - min_y
-
-        margin_x, margin_y = max(width, height) * self._frame_x_percent, max(height, width) * self._frame_y_percent
-        frame_left, frame_bottom = min_x - margin_x, min_y - margin_y
-        frame_right, frame_top = max_x + margin_x, max_y + margin_y
+        frame_left, frame_bottom, frame_right, frame_top = self._frame_coords
+        margin_y = frame_top - self._bounding_box[3]
 
         frame_width = frame_right - frame_left
         frame_center_x = frame_left + (frame_width / 2)
@@ -200,7 +145,7 @@ class TopographicPlan(PlanProps):
                                       title_y,
                                       frame_width * 0.6,
                                       self.font_size,
-                                      graphical_scale_length=(self._frame_coords[2] - self._frame_coords[0]) * 0.4,
+                                      graphical_scale_length=frame_width * 0.4,
                                       area=f"AREA :- {self.topographic_boundary.area} SQ.METRES",
                                       origin=f"ORIGIN :- {self.origin.upper()}")
 
@@ -235,8 +180,8 @@ class TopographicPlan(PlanProps):
                     Dictionary with contour data and statistics
         """
 
-        # Create Delaunay triangulation
-        tri = Delaunay(np.column_stack([self._x, self._y]))
+        # Delaunay triangulation of the survey points
+        tri = self._triangulation
 
         # Add TIN mesh
         self._add_tin_mesh(tri)
@@ -273,13 +218,10 @@ class TopographicPlan(PlanProps):
         yi = np.linspace(self._y.min(), self._y.max(), grid_size)
         grid_x, grid_y = np.meshgrid(xi, yi)
 
-        # Interpolate to grid
-        grid_z = griddata(
-            np.column_stack([self._x, self._y]),
-            self._z,
-            (grid_x, grid_y),
-            method="cubic"
-        )
+        # Interpolate to grid with the Clough-Tocher surface griddata's cubic method builds,
+        # over the plan's triangulation instead of a fresh one
+        interpolator = CloughTocher2DInterpolator(self._triangulation, self._z)
+        grid_z = interpolator(grid_x, grid_y)
 
         # Apply smoothing
         if smoothing > 0:
@@ -293,18 +235,7 @@ class TopographicPlan(PlanProps):
 
     def _add_tin_mesh(self, tri: Delaunay):
         """Add TIN mesh to the drawing"""
-        for simplex in tri.simplices:
-            # Get triangle vertices
-            triangle_points = []
-            for vertex_idx in simplex:
-                point = self._points[vertex_idx]
-                triangle_points.append(point)
-
-            # Close the triangle
-            triangle_points.append(triangle_points[0])
-
-            # Add as 3D polyline
-            self._drawer.add_tin_mesh(triangle_points)
+        self._drawer.add_tin_mesh(self._points, tri.simplices)
 
     # def _add_grid_mesh(self, grid_x, grid_y, grid_z, step: int = 5):
     #     """Add grid mesh to the drawing"""
@@ -351,42 +282,27 @@ class TopographicPlan(PlanProps):
         # Calculate grid line positions
         x_lines = np.arange(0, grid_x.shape[1], step)
         y_lines = np.arange(0, grid_x.shape[0], step)
-
-        # Add horizontal grid lines (constant northing)
-        for i in y_lines:
-            northing = grid_y[i, 0]
-
-            # Create a full horizontal line across the grid
-            points = [
-                (x_min, northing, z_grid),
-                (x_max, northing, z_grid)
-            ]
-
-            self._drawer.add_grid_mesh(points)
-
-            # Add northing label at the left edge
-            self._drawer.add_grid_mesh_label(x_min - 2, northing, z_grid, f'N: {northing:.2f}', 2, rotation=0)
-
-            # Add northing label at the right edge (optional)
-            self._drawer.add_grid_mesh_label(x_max + 1, northing, z_grid, f'{northing:.2f}', 2, rotation=0)
-
-        # Add vertical grid lines (constant easting)
-        for j in x_lines:
-            easting = grid_x[0, j]
-
-            # Create a full vertical line across the grid
-            points = [
-                (easting, y_min, z_grid),
-                (easting, y_max, z_grid)
-            ]
-
-            self._drawer.add_grid_mesh(points)
-
-            # Add an easting label at the bottom edge
-            self._drawer.add_grid_mesh_label(easting, y_min - 2, z_grid, f'E: {easting:.2f}', 2, rotation=90)
-
-            # Add an easting label at the top edge (optional)
-            self._drawer.add_grid_mesh_label(easting, y_max + 1, z_grid,  f'{easting:.2f}', 2, rotation=90)
+        northings = grid_y[y_lines, 0]
+        eastings = grid_x[0, x_lines]
+
+        def at(xs, ys):
+            # (N, 3) points at the grid elevation, either coordinate may be a scalar
+            xs, ys = np.broadcast_arrays(xs, ys)
+            return np.column_stack((xs, ys, np.full(xs.shape, z_grid)))
+
+        # Add horizontal grid lines (constant northing) across the grid,
+        # labelled at the left edge and at the right edge (optional)
+        labels = [f'{northing:.2f}' for northing in northings.tolist()]
+        self._drawer.add_grid_mesh_lines(at(x_min, northings), at(x_max, northings))
+        self._drawer.add_grid_mesh_labels(at(x_min - 2, northings), [f'N: {label}' for label in labels], 2, rotation=0)
+        self._drawer.add_grid_mesh_labels(at(x_max + 1, northings), labels, 2, rotation=0)
+
+        # Add vertical grid lines (constant easting) across the grid,
+        # labelled at the bottom edge and at the top edge (optional)
+        labels = [f'{easting:.2f}' for easting in eastings.tolist()]
+        self._drawer.add_grid_mesh_lines(at(eastings, y_min), at(eastings, y_max))
+        self._drawer.add_grid_mesh_labels(at(eastings, y_min - 2), [f'E: {label}' for label in labels], 2, rotation=90)
+        self._drawer.add_grid_mesh_labels(at(eastings, y_max + 1), labels, 2, rotation=90)
 
         # Add border rectangle
         border_points = [
@@ -420,78 +336,53 @@ class TopographicPlan(PlanProps):
         points = np.column_stack([grid_x.ravel(), grid_y.ravel()])
         grid_z = interpolator(points).reshape(grid_x.shape)
 
-        # Handle NaN values
-        if np.any(np.isnan(grid_z)):
-            grid_z_nearest = griddata(
-                np.column_stack([self._x, self._y]),
-                self._z,
-                (grid_x, grid_y),
-                method='nearest'
-            )
-            grid_z[np.isnan(grid_z)] = grid_z_nearest[np.isnan(grid_z)]
+        # Handle NaN values (outside the TIN hull); only those cells need a nearest-point lookup
+        missing = np.isnan(grid_z)
+        if missing.any():
+            # a KD-tree over the triangulated points, as griddata's nearest method would build
+            _, nearest = cKDTree(self._triangulation.points).query(np.column_stack([grid_x[missing], grid_y[missing]]))
+            grid_z[missing] = self._z[nearest]
 
         return grid_x, grid_y, grid_z
 
     def _generate_contours(self, grid_x, grid_y, grid_z):
         """Generate contour lines from gridded data"""
-        # Calculate contour levels
+        # Calculate contour levels as whole multiples of the interval; counting them in integers
+        # keeps float steps from drifting off the multiples or adding a level past the range
+        interval = self.topographic_setting.contour_interval
         z_min, z_max = np.nanmin(grid_z), np.nanmax(grid_z)
-        levels = np.arange(
-            np.floor(z_min / self.topographic_setting.contour_interval) * self.topographic_setting.contour_interval,
-            np.ceil(z_max / self.topographic_setting.contour_interval) * self.topographic_setting.contour_interval + self.topographic_setting.contour_interval,
-            self.topographic_setting.contour_interval
-        )
+        levels = np.arange(np.floor(z_min / interval), np.ceil(z_max / interval) + 1) * interval
+
+        # Trace the grid with contourpy, the marching squares engine behind matplotlib's contour,
+        # with matplotlib's defaults (mpl2014, corner masking of the NaN cells outside the hull)
+        # but without building a figure
+        generator = contour_generator(grid_x, grid_y, np.ma.masked_invalid(grid_z), name="mpl2014",
+                                      corner_mask=True, line_type=LineType.SeparateCode)
 
-        # Generate contours using matplotlib
-        fig, ax = plt.subplots(figsize=(10, 10))
-        cs = ax.contour(grid_x, grid_y, grid_z, levels=levels)
-        plt.close(fig)
+        # Major levels are multiples of the major interval, within tolerance on either side
+        # (a level of 5.9999999 is 6 for a 2 m major interval)
+        major_contour = self.topographic_setting.major_contour
+        remainders = np.mod(levels, major_contour)
+        major = (remainders < 0.001) | (major_contour - remainders < 0.001)
 
         # Extract contour paths and add to DXF as smooth 3D polylines
-        for level_idx, level in enumerate(cs.levels):
-            is_major = abs(level % self.topographic_setting.major_contour) < 0.001
+        for level, is_major in zip(levels, major.tolist()):
             layer = 'CONTOUR_MAJOR' if is_major else 'CONTOUR_MINOR'
 
             # Get all paths for this level
-            paths = cs.allsegs[level_idx]
-
-            for path in paths:
-                if len(path) > 2:
-                    # Convert to 3D points (add Z coordinate)
-                    points_3d = [(p[0], p[1], level) for p in path]
-
-                    # Create smooth 3D polyline using spline
-                    self._add_smooth_3d_polyline(points_3d, layer)
-
-                    # Add elevation label for major contours
-                    # if is_major and len(path) > 10:
-                    if is_major:
-                        mid_idx = len(path) // 2
-                        self._add_contour_label(float(path[mid_idx][0]), float(path[mid_idx][1]), level)
-
-    def _add_smooth_3d_polyline(self, points: List[Tuple[float, float, float]],
-                                layer: str):
-        """Add a smooth 3D polyline using B-spline"""
-        if len(points) < 4:
-            # For short segments, use a simple polyline
-            self._drawer.add_3d_contour(points, layer)
-        else:
-            # Create B-spline for smooth curves
-            try:
-                self._drawer.add_spline(points, layer)
-            except:
-                # Fallback to polyline if spline fails
-                self._drawer.add_3d_contour(points, layer)
-
-    def _add_contour_label(self, x: float, y: float, elevation: float):
-        """Add elevation label to contour"""
-        self._drawer.add_contour_label(
-            x,
-            y,
-            elevation,
-            f"{elevation:.2f}",
-            self.topographic_setting.contour_label_scale
-        )
+            lines, _ = generator.lines(level)
+            paths = [path for path in lines if len(path) > 2]
+
+            # Create smooth 3D polylines using splines
+            self._drawer.add_3d_contours(paths, level, layer)
+
+            # Add elevation label for major contours, at the middle vertex of every path;
+            # the label text is formatted once for the level
+            # if is_major and len(path) > 10:
+            if is_major and paths:
+                mid_points = np.array([path[len(path) // 2] for path in paths])
+                self._drawer.add_contour_labels(mid_points, level, f"{level:.2f}",
+                                                self.topographic_setting.contour_label_scale)
 
     def draw_topo_map(self):
         if self.topographic_setting.tin:
@@ -516,26 +407,29 @@ class TopographicPlan(PlanProps):
         if len(self.topographic_boundary.coordinates) == 0:
             return
 
-        coord = self._boundary_dict[self.topographic_boundary.coordinates[0].id]
-        height = (self._frame_coords[3] - self._frame_coords[1]) * 0.07
-        self._drawer.draw_north_arrow(coord.easting, self._frame_coords[3] - height, height)
+        eastings, northings = self._boundary_arrays
+        i = self._boundary_index[self.topographic_boundary.coordinates[0].id]
+        easting, northing = float(eastings[i]), float(northings[i])
+        frame_left, frame_bottom, frame_right, frame_top = self._frame_coords
+        height = (frame_top - frame_bottom) * 0.07
+        self._drawer.draw_north_arrow(easting, frame_top - height, height)
 
         # for easting label
-        width = (self._frame_coords[2] - self._frame_coords[0]) * 0.1
+        width = (frame_right - frame_left) * 0.1
 
-        self._drawer.add_north_arrow_label((self._frame_coords[0], coord.northing), (self._frame_coords[0] + width, coord.northing), f"{coord.easting}mE", self.label_size)
-        self._drawer.add_north_arrow_label((self._frame_coords[2], coord.northing),
-                                           (self._frame_coords[2] - width, coord.northing), "",
+        self._drawer.add_north_arrow_label((frame_left, northing), (frame_left + width, northing), f"{easting}mE", self.label_size)
+        self._drawer.add_north_arrow_label((frame_right, northing),
+                                           (frame_right - width, northing), "",
                                            self.label_size)
 
         # for northing label
-        northing_label_y = self._frame_coords[1]
+        northing_label_y = frame_bottom
         if len(self.footers) > 0:
-            northing_label_y = northing_label_y + ((self._frame_coords[3] - self._frame_coords[1]) * 0.25)
+            northing_label_y = northing_label_y + ((frame_top - frame_bottom) * 0.25)
 
 
-        self._drawer.add_north_arrow_label((coord.easting, northing_label_y), (coord.easting, northing_label_y + height), f"{coord.northing}mN", self.label_size)
-        self._drawer.draw_north_arrow_cross(coord.easting, coord.northing, self.beacon_size * 3)
+        self._drawer.add_north_arrow_label((easting, northing_label_y), (easting, northing_label_y + height), f"{northing}mN", self.label_size)
+        self._drawer.draw_north_arrow_cross(easting, northing, self.beacon_size * 3)
 
     def draw(self):
         # Draw elements
@@ -551,5 +445,5 @@ class TopographicPlan(PlanProps):
     def save_dxf(self, file_path: str):
         self._drawer.save_dxf(file_path)
 
-    def save(self) -> str:
-        return self._drawer.save(paper_size=self.page_size, orientation=self.page_orientation)
+    def save(self, formats: tuple = ("dxf", "dwg", "pdf")) -> str:
+        return self._drawer.save(paper_size=self.page_size, orientation=self.page_orientation, formats=formats)
@@ -1,9 +1,12 @@
 import os
+import logging
 import cloudinary
 cloudinary.config(cloud_url=os.getenv("CLOUDINARY_URL"))
 
 import cloudinary.uploader
 
+logger = logging.getLogger(__name__)
+
 def upload_file(file_path, folder="uploads", file_name=None):
   """
   Uploads a file to Cloudinary and returns the upload response.
@@ -18,5 +21,5 @@ def upload_file(file_path, folder="uploads", file_name=None):
     )
     return response.get("secure_url")
   except Exception as e:
-    print(f"Upload failed: {e}")
+    logger.error("Upload failed: %s", e)
     return None
\ No newline at end of file
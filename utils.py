@@ -1,37 +1,180 @@
-from bs4 import BeautifulSoup
+from functools import lru_cache
 from ezdxf.tools.text import MTextEditor
 
-def polygon_orientation(coords):
-    # coords = [(x1,y1), (x2,y2), ...]
-    area = 0
-    for i in range(len(coords)):
-        x1, y1 = coords[i]
-        x2, y2 = coords[(i + 1) % len(coords)]
-        area += (x2 - x1) * (y2 + y1)
-    return "CW" if area > 0 else "CCW"
-
-def line_normals(p1, p2, orientation="CCW"):
-    dx, dy = p2[0]-p1[0], p2[1]-p1[1]
-    if orientation == "CCW":  # inside = left normal
-        inside = (-dy, dx)
-        outside = (dy, -dx)
-    else:  # CW polygon
-        inside = (dy, -dx)
-        outside = (-dy, dx)
+import html
+import re
+import numpy as np
+
+def signed_area(coords) -> float:
+    # shoelace area, positive for counter-clockwise vertex order
+    pts = np.asarray(coords, dtype=np.float64)
+    x, y = pts[:, 0], pts[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+def polygon_stats(coords) -> tuple:
+    # signed area, area centroid (cx, cy) and orientation (1 CCW, -1 CW) from one shoelace pass
+    pts = np.asarray(coords, dtype=np.float64)
+    x, y = pts[:, 0], pts[:, 1]
+    x_next, y_next = np.roll(x, -1), np.roll(y, -1)
+    cross = x * y_next - x_next * y
+    area2 = float(cross.sum())
+    if area2 == 0:  # degenerate polygon, fall back to the vertex mean
+        return 0.0, float(x.mean()), float(y.mean()), 1
+
+    cx = float(((x + x_next) * cross).sum()) / (3 * area2)
+    cy = float(((y + y_next) * cross).sum()) / (3 * area2)
+    return 0.5 * area2, cx, cy, (-1 if area2 < 0 else 1)
+
+def polygon_orientation(coords) -> int:
+    # coords = [(x1,y1), (x2,y2), ...]; 1 for CCW, -1 for CW
+    return -1 if signed_area(coords) < 0 else 1
+
+def unit_normals(dx, dy, orientation=1):
+    # inside/outside unit normals of a line with direction (dx, dy); works element-wise on arrays
+    length = np.hypot(dx, dy)
+    safe = np.where(length == 0, 1.0, length)  # zero-length line has no normal
+    ux, uy = dx / safe, dy / safe
+    # inside is the left normal of a CCW polygon, the right normal of a CW one
+    inside = (-uy * orientation, ux * orientation)
+    outside = (-inside[0], -inside[1])
     return inside, outside
 
-def line_direction(angle) -> str:
-    # Normalize angle between -180 and 180
-    if -90 <= angle <= 90:
-        return "left → right"
-    else:
-        return "right → left"
+def leg_label_layout(from_x, from_y, to_x, to_y, orientation=1, offset=0.0):
+    # batched label geometry for legs given as arrays of end points
+    # returns an (N, 7) array of mid_x, mid_y, degrees_x, degrees_y, minutes_x, minutes_y, text_angle
+    # (the bearing positions already swapped for legs running right to left)
+    dx, dy = to_x - from_x, to_y - from_y
 
-def html_to_mtext(html_text: str):
-    if not html_text:
-        return ""
+    # columns are written in place into one buffer rather than stacked from temporaries
+    layout = np.empty((7, len(dx)), dtype=np.float64)
+    mid_x, mid_y, first_x, first_y, last_x, last_y, text_angle = layout
+
+    # fractional positions, offset outside (bearing) and inside (distance) the polygon
+    _, outside = unit_normals(dx, dy, orientation)
+    offset_x = outside[0] * offset
+    offset_y = outside[1] * offset
+    for out, start, delta, fraction, shift in ((first_x, from_x, dx, 0.2, offset_x), (first_y, from_y, dy, 0.2, offset_y),
+                                               (last_x, from_x, dx, 0.8, offset_x), (last_y, from_y, dy, 0.8, offset_y)):
+        np.multiply(delta, fraction, out=out)
+        out += start
+        out += shift
+    for out, start, end, shift in ((mid_x, from_x, to_x, offset_x), (mid_y, from_y, to_y, offset_y)):
+        np.add(start, end, out=out)
+        out /= 2
+        out -= shift
+
+    # keep text upright
+    np.arctan2(dy, dx, out=text_angle)
+    np.degrees(text_angle, out=text_angle)
+    right_to_left = (text_angle < -90) | (text_angle > 90)
+    np.add(text_angle, 180, out=text_angle, where=right_to_left)
+
+    # degrees read first along the text: swap the end positions of legs drawn right to left
+    for first, last in ((first_x, last_x), (first_y, last_y)):
+        first[right_to_left], last[right_to_left] = last[right_to_left], first[right_to_left]
+
+    return layout.T
+
+def leg_label_records(legs, orientation, offset: float, label_size: float) -> list:
+    # distance, degrees and minutes label records (text, x, y, angle, height), three per leg in leg order;
+    # orientation is one value for all legs or one per leg
+    if not legs:
+        return []
+
+    count = len(legs)
+    from_x = np.fromiter((leg.from_.easting for leg in legs), dtype=np.float64, count=count)
+    from_y = np.fromiter((leg.from_.northing for leg in legs), dtype=np.float64, count=count)
+    to_x = np.fromiter((leg.to.easting for leg in legs), dtype=np.float64, count=count)
+    to_y = np.fromiter((leg.to.northing for leg in legs), dtype=np.float64, count=count)
+    layout = leg_label_layout(from_x, from_y, to_x, to_y, orientation, offset)
+
+    # the Python loop only formats text
+    records = []
+    for leg, (mx, my, dx, dy, mnx, mny, angle) in zip(legs, layout.tolist()):
+        records.append((f"{leg.distance:.2f} m", mx, my, angle, label_size))
+        records.append((f"{leg.bearing.degrees}°", dx, dy, angle, label_size))
+        records.append((f"{leg.bearing.minutes}'", mnx, mny, angle, label_size))
+    return records
+
+# MTEXT codes wrapping the content of inline html tags
+_MTEXT_TAGS = {
+    "b": ("\\B", "\\b"),
+    "strong": ("\\B", "\\b"),
+    "i": ("\\I", "\\i"),
+    "u": (MTextEditor.UNDERLINE_START, MTextEditor.UNDERLINE_STOP),
+}
+
+# void elements, never holding content or taking an end tag (as html.parser treats them)
+_VOID_TAGS = frozenset((
+    "area", "base", "basefont", "bgsound", "br", "col", "command", "embed", "frame", "hr", "image", "img",
+    "input", "isindex", "keygen", "link", "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr"))
+
+# a start tag (with optional attributes), an end tag, or a run of text
+_HTML_TOKEN_RE = re.compile(
+    r"""<(/?)([a-zA-Z][a-zA-Z0-9]*)((?:\s+[^\s/>"'=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+))?)*)\s*(/?)>|([^<]+)""")
+
+def _stream_to_mtext(html_text: str):
+    # walks the tag/text tokens with a stack of open tags instead of building a tree;
+    # returns None for markup the tokenizer does not cover (comments, stray '<', </br>, </img>, ...)
+    parts = []  # MTEXT fragments, joined once at the end
+    stack = [["", False]]  # open tags as [name, has a non-blank child]
+
+    def close_codes(tags):
+        for open_name, _ in reversed(tags):
+            codes = _MTEXT_TAGS.get(open_name)
+            if codes is not None:
+                parts.append(codes[1])
+
+    pos = 0
+    for match in _HTML_TOKEN_RE.finditer(html_text):
+        if match.start() != pos:
+            return None
+        pos = match.end()
+
+        closing, name, _, self_closing, text = match.groups()
+        if text is not None:  # Plain text
+            text = html.unescape(text).strip()
+            if text:
+                parts.append(text)
+                stack[-1][1] = True
+            continue
+
+        name = name.lower()
+        if not closing:
+            parent = stack[-1]
+            if name == "p" and parent[1]:
+                parts.append(MTextEditor.NEW_LINE)
+            parent[1] = True
+            if name in _VOID_TAGS:
+                if name == "br":
+                    parts.append(MTextEditor.NEW_LINE)
+                continue
+            codes = _MTEXT_TAGS.get(name)
+            if codes is not None:
+                parts.append(codes[0])
+            stack.append([name, False])
+            if not self_closing:
+                continue
+        elif name in _VOID_TAGS:
+            return None
+
+        # close up to the innermost open tag of that name, ignoring unmatched end tags
+        for depth in range(len(stack) - 1, 0, -1):
+            if stack[depth][0] == name:
+                close_codes(stack[depth:])
+                del stack[depth:]
+                break
+
+    if pos != len(html_text):
+        return None
+
+    # tags left open are closed at the end of the text
+    close_codes(stack[1:])
+    return "".join(parts)
+
+def _soup_to_mtext(html_text: str):
+    from bs4 import BeautifulSoup
 
-    html_text = html_text.replace('\n', '')
     soup = BeautifulSoup(html_text, "html.parser")
     editor = MTextEditor()
 
@@ -39,34 +182,43 @@ def html_to_mtext(html_text: str):
         for child in tag.children:
             if isinstance(child, str):  # Plain text
                 editor.append(child.strip())
-            else:
-                # Apply formatting recursively
-                if child.name == "b" or child.name == "strong":
-                    editor.append("\\B")
-                    parse_tag(child)
-                    editor.append("\\b")
-                elif child.name == "i":
-                    editor.append("\\I")
-                    parse_tag(child)
-                    editor.append("\\i")
-                elif child.name == "u":
-                    editor.append(MTextEditor.UNDERLINE_START)
-                    parse_tag(child)
-                    editor.append(MTextEditor.UNDERLINE_STOP)
-                elif child.name == "br":
+                continue
+
+            # Apply formatting recursively
+            codes = _MTEXT_TAGS.get(child.name)
+            if codes is not None:
+                editor.append(codes[0])
+                parse_tag(child)
+                editor.append(codes[1])
+            elif child.name == "br":
+                editor.append(MTextEditor.NEW_LINE)
+            elif child.name == "p":
+                prev = child.previous_sibling
+                while prev and str(prev).strip() == "":
+                    prev = prev.previous_sibling
+                if prev is not None:
                     editor.append(MTextEditor.NEW_LINE)
-                elif child.name == "p":
-                    prev = child.previous_sibling
-                    while prev and str(prev).strip() == "":
-                        prev = prev.previous_sibling
-                    if prev is not None:
-                        editor.append(MTextEditor.NEW_LINE)
-                    parse_tag(child)
-                    # editor.append(MTextEditor.NEW_LINE)
-                else:
-                    parse_tag(child)
+                parse_tag(child)
+                # editor.append(MTextEditor.NEW_LINE)
+            else:
+                parse_tag(child)
 
     parse_tag(soup)
-    result = str(editor)
+    return editor
+
+@lru_cache(maxsize=512)
+def html_to_mtext(html_text: str):
+    if not html_text:
+        return ""
+
+    html_text = html_text.replace('\n', '')
+
+    # plain text has nothing to parse
+    if "<" not in html_text and "&" not in html_text:
+        return html_text.strip()
+
+    result = _stream_to_mtext(html_text)
+    if result is None:
+        result = str(_soup_to_mtext(html_text))
     result = result.replace('\n', '')
     return result
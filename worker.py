@@ -0,0 +1,14 @@
+# Runs in the plan process pool: spawned workers import this module (not app.py)
+# to unpickle run_plan, so it stays free of the Flask app and its executor.
+
+# files bundled into the uploaded zip, narrowed with ?formats=dxf,dwg (skipping the PDF render)
+FORMATS = ("dxf", "dwg", "pdf")
+
+
+def run_plan(plan_class, payload: bytes, formats: tuple = FORMATS) -> dict:
+    # the request body is parsed and validated in the worker, straight from the JSON bytes
+    plan = plan_class.model_validate_json(payload)
+    plan.draw()
+
+    url = plan.save(formats=formats)
+    return {"filename": plan.name, "url": url}